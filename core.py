@@ -0,0 +1,431 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import streamlit as st
+import gspread
+from google.oauth2.service_account import Credentials
+from google import genai
+from google.genai import types
+
+# --- Configuration ---
+SHEET_NAME = "Gemini Logs"
+SHEET_BATCH_SIZE = 5
+SHEET_FLUSH_INTERVAL = 2.0
+SHEET_QUEUE_SIZE = 1000
+SHEET_RETRY_DELAY = 1.0
+SHEET_RETRY_MAX_DELAY = 60.0
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+EMBEDDING_MODEL = "gemini-embedding-001"
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_SIZE = 500
+SEMANTIC_CACHE_KEYS = 32
+MAX_TURNS = 20
+MAX_MESSAGES = MAX_TURNS * 2
+SUMMARY_MODEL = "gemini-2.5-flash-lite"
+SUMMARY_TIMEOUT = 10.0
+MODEL_MAPPING = {
+    "gemini-3-pro-preview": "gemini-3-pro-preview"
+}
+MODEL_OPTIONS = tuple(MODEL_MAPPING.keys())
+
+# --- Page Assets ---
+def _svg_b64(text, color):
+    svg = (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="400" height="75">'
+        f'<rect width="100%" height="100%" fill="{color}"/>'
+        '<text x="50%" y="50%" fill="white" font-family="sans-serif" font-size="24" '
+        f'text-anchor="middle" dominant-baseline="central">{text}</text>'
+        '</svg>'
+    )
+    return "data:image/svg+xml;base64," + base64.b64encode(svg.encode()).decode()
+
+# Inline placeholders so a page load does not fetch three remote images
+LOGO_IMAGES = (
+    _svg_b64("UFS Logo", "orange"),
+    _svg_b64("Afrikaans Department", "blue"),
+    _svg_b64("ICDF", "blue"),
+)
+
+# --- Dummy Translation Function ---
+def translate_text(text, lang):
+    if lang == "af":
+        return "AFRIKAANS: " + text
+    return text  # English default
+
+# --- Google Sheets Connection ---
+# Last background write error, shared by every session since they log to the same sheet
+_SHEET_ERRORS = deque(maxlen=1)
+# Rows that could never be written, counted so the page can say they were dropped
+_SHEET_DROPS = {"lock": threading.Lock(), "count": 0, "reason": ""}
+
+@st.cache_resource
+def _sheet_lock():
+    # Cached so the same lock survives reruns and is shared by every session
+    return threading.Lock()
+
+class SheetConnection:
+    # Bundles the worksheet with its writer thread so cache eviction can shut both down
+    def __init__(self, client, sheet):
+        self.client = client
+        self.sheet = sheet
+        self.queue = queue.Queue(maxsize=SHEET_QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._writer = threading.Thread(
+            target=_writer_loop, args=(sheet, self.queue, self._stop), daemon=True
+        )
+        self._writer.start()
+
+    def close(self):
+        self._stop.set()
+        self._writer.join(timeout=SHEET_FLUSH_INTERVAL * 2)
+        self.client.http_client.session.close()
+
+def _release_sheet_connection(connection):
+    if connection is not None:
+        connection.close()
+
+@st.cache_resource(on_release=_release_sheet_connection)
+def get_sheet_connection():
+    scopes = [
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive"
+    ]
+    try:
+        if "gcp_service_account" in st.secrets:
+            # Only one session authorises at a time on a cold start
+            with _sheet_lock():
+                s_account_info = st.secrets["gcp_service_account"]
+                creds = Credentials.from_service_account_info(
+                    s_account_info, scopes=scopes
+                )
+                client = gspread.authorize(creds)
+                sheet = client.open(SHEET_NAME).sheet1
+            return SheetConnection(client, sheet)
+        else:
+            return None
+    except Exception as e:
+        st.error(f"❌ Connection Error: {e}")
+        return None
+
+# --- Logging to Sheets ---
+def _record_dropped(count, reason):
+    with _SHEET_DROPS["lock"]:
+        _SHEET_DROPS["count"] += count
+        _SHEET_DROPS["reason"] = reason
+
+def _is_transient(e):
+    # Rate limits and server errors clear up on their own, other 4xx mean the rows are bad
+    if isinstance(e, gspread.exceptions.APIError):
+        status = e.response.status_code
+        return status == 429 or status >= 500
+    # Network errors carry no status and are worth retrying
+    return True
+
+def _append_batch(sheet, batch):
+    # Returns the rows to retry later; rows Sheets rejects outright are dropped
+    try:
+        sheet.append_rows(batch, value_input_option="RAW", insert_data_option="INSERT_ROWS")
+    except Exception as e:
+        if _is_transient(e):
+            _SHEET_ERRORS.append(str(e))
+            return batch
+        if len(batch) == 1:
+            _record_dropped(1, str(e))
+            return []
+        # Split so one bad row (e.g. over the cell size limit) cannot hold back the rest
+        mid = len(batch) // 2
+        left = _append_batch(sheet, batch[:mid])
+        if left:
+            return left + batch[mid:]
+        return _append_batch(sheet, batch[mid:])
+    _SHEET_ERRORS.clear()
+    return []
+
+def _writer_loop(sheet, q, stop):
+    batch = []
+    delay = SHEET_RETRY_DELAY
+    while not stop.is_set():
+        try:
+            batch.append(q.get(timeout=SHEET_FLUSH_INTERVAL))
+            if len(batch) < SHEET_BATCH_SIZE:
+                continue
+        except queue.Empty:
+            if not batch:
+                continue
+        batch = _append_batch(sheet, batch)
+        if not batch:
+            delay = SHEET_RETRY_DELAY
+            continue
+        if len(batch) > SHEET_QUEUE_SIZE:
+            _record_dropped(len(batch) - SHEET_QUEUE_SIZE, "too many rows waiting for Sheets")
+            batch = batch[-SHEET_QUEUE_SIZE:]
+        # Back off before retrying so a rate-limited or failing API is not hammered
+        stop.wait(delay)
+        delay = min(delay * 2, SHEET_RETRY_MAX_DELAY)
+
+    # Drain what is left so releasing the connection does not lose rows
+    while True:
+        try:
+            batch.append(q.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        left = _append_batch(sheet, batch)
+        if left:
+            _record_dropped(len(left), "connection closed while Sheets was unavailable")
+
+def report_sheet_errors():
+    if _SHEET_ERRORS:
+        st.error(f"Failed to write to Sheet: {_SHEET_ERRORS[-1]}")
+    if _SHEET_DROPS["count"]:
+        st.warning(
+            f"{_SHEET_DROPS['count']} log row(s) could not be written to Sheet and were dropped. "
+            f"Last reason: {_SHEET_DROPS['reason']}"
+        )
+
+def save_to_google_sheets(user_id, model_name, prompt, response, is_clarification):
+    connection = get_sheet_connection()
+    if connection is None:
+        return
+    timestamp = time.strftime(TIMESTAMP_FORMAT)
+    clarification_log = "TRUE" if is_clarification else "FALSE"
+    row_data = [user_id, timestamp, model_name, prompt, response, clarification_log]
+    try:
+        connection.queue.put_nowait(row_data)
+    except queue.Full:
+        # Drop the row rather than block the chat while Sheets is unreachable
+        _record_dropped(1, "log queue is full")
+
+# --- Gemini Client ---
+@st.cache_resource
+def get_genai_client():
+    return genai.Client(api_key=st.secrets["api_keys"]["google"])
+
+@st.cache_resource
+def _event_loop():
+    # One long-lived loop for the aio client: its pooled keep-alive connections are
+    # bound to the loop that opened them, so a fresh asyncio.run per call breaks them
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def _run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+
+async def _agen(client, model_id, contents, config):
+    return await client.aio.models.generate_content(
+        model=model_id,
+        contents=contents,
+        config=config
+    )
+
+async def _aclarify(client, model_id, clarify_contents, translate_contents, config):
+    replies = await asyncio.gather(
+        _agen(client, model_id, clarify_contents, config),
+        _agen(client, model_id, translate_contents, config)
+    )
+    return [reply.text or "" for reply in replies]
+
+@functools.lru_cache(maxsize=32)
+def _config_for(system_instruction_text, temperature):
+    # The system instruction rarely changes within a session, so validate it once
+    return types.GenerateContentConfig(
+        temperature=temperature,
+        system_instruction=system_instruction_text
+    )
+
+# --- Semantic Response Cache ---
+@st.cache_resource
+def get_semantic_cache():
+    # Shared by every session: (model_id, instruction hash) -> unit vectors + replies,
+    # least recently used first so the oldest key is evicted past SEMANTIC_CACHE_KEYS
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
+
+def _semantic_key(model_id, system_instruction_text):
+    # Hash the free-text instruction so long edited prompts are not kept as dict keys
+    return model_id, hashlib.sha256(system_instruction_text.encode()).hexdigest()
+
+def _embed_prompt(text):
+    # Any embedding problem just skips the semantic cache; the prompt still goes to Gemini
+    try:
+        result = get_genai_client().models.embed_content(model=EMBEDDING_MODEL, contents=text)
+        if not result.embeddings or not result.embeddings[0].values:
+            return None
+        vec = np.asarray(result.embeddings[0].values, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+    except Exception:
+        return None
+    if not np.isfinite(norm) or norm == 0:
+        return None
+    return vec / norm
+
+def lookup_semantic_cache(model_id, system_instruction_text, vec):
+    cache = get_semantic_cache()
+    key = _semantic_key(model_id, system_instruction_text)
+    with cache["lock"]:
+        entry = cache["entries"].get(key)
+        if entry is None:
+            return None
+        cache["entries"].move_to_end(key)
+        sims = entry["vectors"] @ vec
+        best = int(np.argmax(sims))
+        if sims[best] > SEMANTIC_CACHE_THRESHOLD:
+            return entry["responses"][best]
+    return None
+
+def store_semantic_cache(model_id, system_instruction_text, vec, response):
+    cache = get_semantic_cache()
+    key = _semantic_key(model_id, system_instruction_text)
+    with cache["lock"]:
+        entries = cache["entries"]
+        entry = entries.setdefault(
+            key, {"vectors": np.empty((0, vec.size), dtype=np.float32), "responses": []}
+        )
+        entries.move_to_end(key)
+        entry["vectors"] = np.vstack([entry["vectors"], vec])[-SEMANTIC_CACHE_SIZE:]
+        entry["responses"] = (entry["responses"] + [response])[-SEMANTIC_CACHE_SIZE:]
+        while len(entries) > SEMANTIC_CACHE_KEYS:
+            entries.popitem(last=False)
+
+@st.cache_data(ttl=24 * 60 * 60, max_entries=256, show_spinner=False)
+def _cached_reply(model_id, system_instruction_text, prompt):
+    # Exact repeats are served by st.cache_data without an embedding call;
+    # only misses fall through to the semantic cache and then to Gemini
+    vec = _embed_prompt(prompt)
+    if vec is not None:
+        cached = lookup_semantic_cache(model_id, system_instruction_text, vec)
+        if cached is not None:
+            return cached
+
+    config = _config_for(system_instruction_text, 0.7)
+    contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
+    reply = _run_async(_agen(get_genai_client(), model_id, contents, config)).text or ""
+    if vec is not None and reply:
+        store_semantic_cache(model_id, system_instruction_text, vec, reply)
+    return reply
+
+# --- Conversation Summary ---
+@st.cache_resource
+def _pool():
+    return ThreadPoolExecutor(max_workers=2)
+
+def summary_text(future, timeout=SUMMARY_TIMEOUT):
+    if future is None:
+        return ""
+    try:
+        return future.result(timeout=timeout)
+    except Exception:
+        return ""
+
+def _summarize(client, previous_future, evicted):
+    # Wait for the previous summary without a deadline. Its own call is bounded by
+    # SUMMARY_TIMEOUT, so a slow link never cuts the chain short
+    previous = summary_text(previous_future, timeout=None)
+    transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in evicted)
+    prompt = (
+        "Summarise this tutoring conversation in a few sentences. "
+        "Keep any facts or words the student may ask about again.\n\n"
+        + (f"Summary so far:\n{previous}\n\n" if previous else "")
+        + transcript
+    )
+    try:
+        response = client.models.generate_content(
+            model=SUMMARY_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                http_options=types.HttpOptions(timeout=int(SUMMARY_TIMEOUT * 1000))
+            )
+        )
+    except Exception:
+        # Keep the summary built so far rather than wiping it on one failed call
+        return previous
+    return response.text or previous
+
+def append_message(role, content):
+    messages = st.session_state["messages"]
+    api_contents = st.session_state["api_contents"]
+    messages.append({"role": role, "content": content})
+    # Build the API message once here instead of rebuilding the whole history per call
+    api_contents.append(
+        types.Content(
+            role="user" if role == "user" else "model",
+            parts=[types.Part.from_text(text=content)]
+        )
+    )
+    # Once a turn completes, fold the oldest turn into the running summary in the
+    # background so the deque never has to evict unsummarised messages
+    if role == "assistant" and len(messages) >= messages.maxlen - 1:
+        evicted = [messages.popleft(), messages.popleft()]
+        api_contents.popleft()
+        api_contents.popleft()
+        st.session_state["summary_future"] = _pool().submit(
+            _summarize, get_genai_client(), st.session_state["summary_future"], evicted
+        )
+
+# --- Gemini Response ---
+# Yields the reply in chunks so callers can render it with st.write_stream
+def get_ai_response(model_selection, chat_history, api_history, system_instruction_text,
+                    is_clarification=False, history_summary=""):
+    try:
+        client = get_genai_client()
+    except KeyError:
+        yield "Error: Gemini API key not found in secrets."
+        return
+
+    try:
+        model_id = MODEL_MAPPING.get(model_selection)
+        if model_id is not None:
+            api_contents = []
+            if history_summary:
+                api_contents.append(
+                    types.Content(
+                        role="user",
+                        parts=[types.Part.from_text(
+                            text="Summary of our earlier conversation:\n" + history_summary
+                        )]
+                    )
+                )
+            api_contents.extend(api_history)
+
+            config = _config_for(system_instruction_text, 0.7)
+
+            # A first prompt has no context, so earlier answers to it can be reused
+            if len(chat_history) == 1 and not history_summary:
+                yield _cached_reply(model_id, system_instruction_text, chat_history[0]["content"])
+                return
+
+            # Simplified explanation and Afrikaans translation are independent, run both at once
+            if is_clarification and len(chat_history) >= 2:
+                translate_contents = [
+                    types.Content(
+                        role="user",
+                        parts=[types.Part.from_text(
+                            text="Translate the following explanation into Afrikaans:\n\n"
+                                 + chat_history[-2]["content"]
+                        )]
+                    )
+                ]
+                explanation, translation = _run_async(
+                    _aclarify(client, model_id, api_contents, translate_contents, config)
+                )
+                yield f"{explanation}\n\n---\n\n{translation}"
+                return
+
+            for chunk in client.models.generate_content_stream(
+                model=model_id,
+                contents=api_contents,
+                config=config
+            ):
+                if chunk.text:
+                    yield chunk.text
+        else:
+            yield "Error: Selected model not configured."
+    except Exception as e:
+        yield f"Error calling API: {str(e)}"
@@ -1,107 +1,36 @@
+from collections import deque
 import streamlit as st
-import gspread
-from google.oauth2.service_account import Credentials
-from datetime import datetime
-from google import genai
-from google.genai import types
-
-# --- Configuration ---
-SHEET_NAME = "Gemini Logs"
-MODEL_MAPPING = {
-    "gemini-3-pro-preview": "gemini-3-pro-preview"
-}
-
-# --- Dummy Translation Function ---
-def translate_text(text, lang):
-    if lang == "af":
-        return "AFRIKAANS: " + text
-    return text  # English default
-
-# --- Google Sheets Connection ---
-@st.cache_resource
-def get_sheet_connection():
-    scopes = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
-    try:
-        if "gcp_service_account" in st.secrets:
-            s_account_info = st.secrets["gcp_service_account"]
-            creds = Credentials.from_service_account_info(
-                s_account_info, scopes=scopes
-            )
-            client = gspread.authorize(creds)
-            sheet = client.open(SHEET_NAME).sheet1
-            return sheet
-        else:
-            return None
-    except Exception as e:
-        st.error(f"❌ Connection Error: {e}")
-        return None
-
-sheet = get_sheet_connection()
-
-# --- Logging to Sheets ---
-def save_to_google_sheets(user_id, model_name, prompt, response, is_clarification):
-    if sheet is None:
-        return
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    clarification_log = "TRUE" if is_clarification else "FALSE"
-    row_data = [user_id, timestamp, model_name, prompt, response, clarification_log]
-    try:
-        sheet.append_row(row_data)
-    except Exception as e:
-        st.error(f"Failed to write to Sheet: {e}")
-
-# --- Gemini Response ---
-def get_ai_response(model_selection, chat_history, system_instruction_text):
-    try:
-        api_key = st.secrets["api_keys"]["google"]
-    except KeyError:
-        return "Error: Gemini API key not found in secrets."
-
-    try:
-        if model_selection in MODEL_MAPPING:
-            client = genai.Client(api_key=api_key)
-            model_id = MODEL_MAPPING[model_selection]
-
-            api_contents = []
-            for msg in chat_history:
-                role = "user" if msg["role"] == "user" else "model"
-                api_contents.append(
-                    types.Content(
-                        role=role,
-                        parts=[types.Part.from_text(text=msg["content"])]
-                    )
-                )
-
-            config = types.GenerateContentConfig(
-                temperature=0.7,
-                system_instruction=system_instruction_text 
-            )
+from core import (
+    LOGO_IMAGES,
+    MAX_MESSAGES,
+    MODEL_OPTIONS,
+    append_message,
+    get_ai_response,
+    report_sheet_errors,
+    save_to_google_sheets,
+    summary_text,
+    translate_text,
+)
 
-            response = client.models.generate_content(
-                model=model_id,
-                contents=api_contents,
-                config=config
-            )
-            return response.text
-        else:
-            return "Error: Selected model not configured."
-    except Exception as e:
-        return f"Error calling API: {str(e)}"
+CLARIFICATION_PROMPT = "I don't understand the previous explanation. Please break it down further."
+allowed_languages = ["English", "Afrikaans"]
 
+# Only queues the clarification; the chat fragment runs it so the user sees progress
 def trigger_clarification():
-    st.session_state["auto_execute_clarification"] = True
+    if st.session_state["messages"] and st.session_state["messages"][-1]["role"] == "assistant":
+        st.session_state["pending_clarification"] = True
 
 def clear_chat_history():
-    st.session_state["messages"] = []
-    st.session_state["auto_execute_clarification"] = False
+    st.session_state["messages"] = deque(maxlen=MAX_MESSAGES)
+    st.session_state["api_contents"] = deque(maxlen=MAX_MESSAGES)
+    st.session_state["summary_future"] = None
+    st.session_state.pop("pending_clarification", None)
+    st.session_state.pop("pending_prompt", None)
 
 # Function for Elaborate Further
 def elaborate_further():
     if st.session_state["messages"] and st.session_state["messages"][-1]["role"] == "assistant":
-        st.session_state["auto_execute_clarification"] = True
+        trigger_clarification()
     else:
         st.warning("⚠️ The question you’ve asked is out of context, I cannot elaborate further.")
 
@@ -112,18 +41,20 @@ st.set_page_config(page_title="Gemini Chat", layout="wide")
 
 # State init
 if "messages" not in st.session_state:
-    st.session_state["messages"] = []
-if "auto_execute_clarification" not in st.session_state:
-    st.session_state["auto_execute_clarification"] = False
+    st.session_state["messages"] = deque(maxlen=MAX_MESSAGES)
+if "api_contents" not in st.session_state:
+    st.session_state["api_contents"] = deque(maxlen=MAX_MESSAGES)
+if "summary_future" not in st.session_state:
+    st.session_state["summary_future"] = None
 
 # Images
 img_col1, img_col2, img_col3 = st.columns(3)
 with img_col1:
-    st.image("https://placehold.co/400x75/orange/white?text=UFS+Logo", use_container_width=True)
+    st.image(LOGO_IMAGES[0], width="stretch")
 with img_col2:
-    st.image("https://placehold.co/400x75/blue/white?text=Afrikaans+Department", use_container_width=True)
+    st.image(LOGO_IMAGES[1], width="stretch")
 with img_col3:
-    st.image("https://placehold.co/400x75/blue/white?text=ICDF", use_container_width=True)
+    st.image(LOGO_IMAGES[2], width="stretch")
 
 st.title("Afrikaans Assistant - Demo")
 st.markdown("---")
@@ -134,7 +65,7 @@ with st.container():
     with col1:
         sub_col1, sub_col2 = st.columns([3, 1])
         with sub_col1:
-            user_id_input = st.text_input("👤 User ID", placeholder="student_123")
+            user_id_input = st.text_input("👤 User ID", placeholder="student_123", key="user_id")
         with sub_col2:
             st.write("")
             st.write("")
@@ -144,7 +75,9 @@ with st.container():
                 else:
                     st.toast("⚠️ Please type an ID")
 
-        selected_label = st.selectbox("Select AI Model", options=list(MODEL_MAPPING.keys()))
+        selected_label = st.selectbox(
+            "Select AI Model", options=MODEL_OPTIONS, key="model_label"
+        )
         if st.button("🗑️ Clear Chat History", type="primary"):
             clear_chat_history()
             st.rerun()
@@ -155,7 +88,8 @@ with st.container():
             "Explain answers in simple English first, then Afrikaans."
         )
         system_instruction_input = st.text_area(
-            "🛠️ System Instruction", value=default_system_msg, height=150
+            "🛠️ System Instruction", value=default_system_msg, height=150,
+            key="system_instruction"
         )
 
 # ------------------------------------------------------------
@@ -165,78 +99,115 @@ language_options = [
     "English", "Afrikaans", "Zulu", "Xhosa", "Sesotho",
     "Tswana", "Xitsonga", "French", "German"
 ]
-selected_language = st.selectbox("🌍 Choose output language", language_options, index=0)
-allowed_languages = ["English", "Afrikaans"]
+selected_language = st.selectbox(
+    "🌍 Choose output language", language_options, index=0, key="output_language"
+)
 
 # Custom message for unsupported languages
 unsupported_msg = st.text_area(
     "✏️ Message for unsupported languages",
     value="I will translate whatever you write in both English and Afrikaans.",
     height=80,
+    key="unsupported_msg"
 )
 
-# ------------------------------------------------------------
-# Chat Input
-# ------------------------------------------------------------
-prompt = st.chat_input("Ask Gemini anything...")
-clarification_triggered = st.session_state["auto_execute_clarification"]
-
-final_prompt = None
-is_clarification = False
-
-if clarification_triggered:
-    if st.session_state["messages"] and st.session_state["messages"][-1]["role"] == "assistant":
-        final_prompt = "I don't understand the previous explanation. Please break it down further."
-        is_clarification = True
-    st.session_state["auto_execute_clarification"] = False
-elif prompt:
-    final_prompt = prompt
+def format_output(response_en, selected_language, unsupported_msg):
+    # LANGUAGE FILTER
+    if selected_language not in allowed_languages:
+        return unsupported_msg
+    lang_code = "af" if selected_language == "Afrikaans" else "en"
+    return translate_text(response_en, lang_code)
 
-# ------------------------------------------------------------
-# Execute Prompt
-# ------------------------------------------------------------
-if final_prompt:
-    if not user_id_input.strip():
+def run_turn(prompt, is_clarification, user_id, selected_label, system_instruction,
+             selected_language, unsupported_msg):
+    if not user_id.strip():
         st.error("⚠️ Please enter a User ID first.")
-    else:
-        with st.chat_message("user"):
-            st.markdown(final_prompt)
-        st.session_state["messages"].append({"role": "user", "content": final_prompt})
+        return
+
+    with st.chat_message("user"):
+        st.markdown(prompt)
 
+    # The reply would only be replaced by the custom message, so skip Gemini entirely
+    if selected_language not in allowed_languages:
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response_en = get_ai_response(
-                    selected_label,
-                    st.session_state["messages"],
-                    system_instruction_input
-                )
-
-            # LANGUAGE FILTER
-            if selected_language not in allowed_languages:
-                final_output = unsupported_msg
-            else:
-                lang_code = "af" if selected_language == "Afrikaans" else "en"
-                final_output = translate_text(response_en, lang_code)
-
-            st.markdown(final_output)
-
-        st.session_state["messages"].append({"role": "assistant", "content": response_en})
-
-        # Save logs
-        save_to_google_sheets(
-            user_id_input,
-            selected_label,
-            final_prompt,
-            response_en,
-            is_clarification
-        )
+            st.markdown(unsupported_msg)
+        save_to_google_sheets(user_id, selected_label, prompt, unsupported_msg, is_clarification)
+        return
+
+    append_message("user", prompt)
+
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        with st.spinner("Thinking..."):
+            stream = get_ai_response(
+                selected_label,
+                st.session_state["messages"],
+                st.session_state["api_contents"],
+                system_instruction,
+                is_clarification=is_clarification,
+                history_summary=summary_text(st.session_state["summary_future"])
+            )
+            with placeholder:
+                response_en = st.write_stream(stream)
+
+        placeholder.markdown(format_output(response_en, selected_language, unsupported_msg))
+
+    append_message("assistant", response_en)
+
+    # Save logs
+    save_to_google_sheets(
+        user_id,
+        selected_label,
+        prompt,
+        response_en,
+        is_clarification
+    )
+
+# Clarification clicks rerun only this fragment, not the header and config widgets above
+@st.fragment
+def chat_fragment(user_id, selected_label, system_instruction, selected_language, unsupported_msg):
+    settings = (user_id, selected_label, system_instruction, selected_language, unsupported_msg)
+
+    # Checked here so background Sheets failures show on fragment-only reruns too
+    report_sheet_errors()
+
+    # ------------------------------------------------------------
+    # Clarification
+    # ------------------------------------------------------------
+    # Set only by the clarification callbacks; popping it is the one check per rerun
+    if st.session_state.pop("pending_clarification", False):
+        run_turn(CLARIFICATION_PROMPT, True, *settings)
+
+    # ------------------------------------------------------------
+    # Execute Prompt
+    # ------------------------------------------------------------
+    # Popped so a fragment-only rerun (e.g. a button click) does not resend it
+    prompt = st.session_state.pop("pending_prompt", None)
+    if prompt:
+        run_turn(prompt, False, *settings)
+
+    # ------------------------------------------------------------
+    # Clarification & Elaborate Further Buttons
+    # ------------------------------------------------------------
+    if st.session_state["messages"] and st.session_state["messages"][-1]["role"] == "assistant":
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            st.button("🤔 I don't understand this", on_click=trigger_clarification)
+        with col2:
+            st.button("📝 Elaborate Further", on_click=elaborate_further)
 
 # ------------------------------------------------------------
-# Clarification & Elaborate Further Buttons
+# Chat Input
 # ------------------------------------------------------------
-if st.session_state["messages"] and st.session_state["messages"][-1]["role"] == "assistant":
-    col1, col2 = st.columns([1, 1])
-    with col1:
-        st.button("🤔 I don't understand this", on_click=trigger_clarification)
-    with col2:
-        st.button("📝 Elaborate Further", on_click=elaborate_further)
+# Kept outside the fragment so it stays pinned to the bottom of the page
+prompt = st.chat_input("Ask Gemini anything...")
+if prompt:
+    st.session_state["pending_prompt"] = prompt
+
+chat_fragment(
+    user_id_input,
+    selected_label,
+    system_instruction_input,
+    selected_language,
+    unsupported_msg
+)